@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# Benchmark suite for the module install and remove paths of the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education).
+# Synthetic module trees are served by a local rsync daemon and a local web server,
+# and the commands used by install-modules.py (from commands.py) and the module
+# removal of remove-modules.py (from storage.py) are timed against them so that
+# performance regressions can be spotted.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import commands
+import functools
+import json
+import os
+import shutil
+import socket
+import statistics
+import storage
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Synthetic modules: name -> (number of files, size of each file in bytes)
+MODULES = { 'en-small-pages':(2000, 8*2**10), 'en-medium-mixed':(300, 256*2**10), 'en-large-video':(4, 64*2**20) }
+
+# Synthetic ZIM file size in bytes
+ZIM_SIZE = 128*2**20
+
+# Helper functions
+def timed_function(function):
+    ''' Call a function and return its duration in seconds (None if it returns False)
+    '''
+    start = time.perf_counter()
+    if not function():
+        return None
+    return time.perf_counter() - start
+
+def timed(cmd):
+    ''' Execute a system command quietly and return its duration in seconds (None on failure)
+    '''
+    return timed_function(lambda: subprocess.run(cmd.split(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0)
+
+def free_port():
+    ''' Return an unused local TCP port
+    '''
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def create_module(path, files, size):
+    ''' Create a synthetic module tree with files spread over nested folders
+    '''
+    for i in range(files):
+        folder = os.path.join(path, f'section{i % 10}', f'chapter{i % 7}')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'file{i}.html'), 'wb') as f:
+            f.write(os.urandom(size))
+    with open(os.path.join(path, 'index.htmlf'), 'w') as f:
+        f.write(f'<div class="indexmodule">\n<h2><a href="modules/{os.path.basename(path)}">Synthetic module</a></h2>\n</div>\n')
+
+def start_rsync(source, workdir):
+    ''' Start a local rsync daemon serving the synthetic modules as "rachelmods"
+    '''
+    port = free_port()
+    config = os.path.join(workdir, 'rsyncd.conf')
+    with open(config, 'w') as f:
+        f.write(f'use chroot = no\npid file = {workdir}/rsyncd.pid\n[rachelmods]\n\tpath = {source}\n\tread only = yes\n')
+    daemon = subprocess.Popen(['rsync', '--daemon', '--no-detach', f'--port={port}', f'--config={config}'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait for the daemon to accept connections
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return daemon, port
+        except OSError:
+            time.sleep(0.1)
+    daemon.terminate()
+    return None, None
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    ''' Static file handler that does not log every request
+    '''
+    def log_message(self, format, *args):
+        pass
+
+def start_http(source):
+    ''' Start a local web server (with directory listings) serving the synthetic ZIM files
+    '''
+    handler = functools.partial(QuietHandler, directory=source)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+def bench_rsync_module(name, port, target):
+    ''' Time the install and remove path of a static (rsync) module
+    '''
+    module = os.path.join(target, name)
+    return { 'transfer':timed(commands.rsync_module(name, f'rsync://127.0.0.1:{port}/rachelmods', target)),
+             'chown':timed(commands.set_owner(module, f'{os.getuid()}:{os.getgid()}')),
+             'chmod':timed(commands.set_permissions(module)),
+             'remove':timed_function(lambda: storage.remove_module(name, target)) }
+
+def bench_zim_module(port, target):
+    ''' Time the install and remove path of a kiwix (ZIM) module
+    '''
+    url = f'http://127.0.0.1:{port}/'
+    module = os.path.join(target, 'en-synthetic')
+    results = { 'catalog':timed(commands.list_files(url)) if shutil.which('lynx') else None }
+    os.makedirs(module)
+    results['transfer'] = timed(commands.download(f'{url}synthetic_2024-01.zim', f'{module}/en-synthetic.zim'))
+    results['remove'] = timed_function(lambda: storage.remove_module('en-synthetic', target))
+    return results
+
+def run(repeat, workdir):
+    ''' Run every benchmark the given number of times and return the median durations
+    '''
+    source, target = os.path.join(workdir, 'source'), os.path.join(workdir, 'target')
+    os.makedirs(target)
+    print('Creating synthetic modules...', file=sys.stderr)
+    for name, (files, size) in MODULES.items():
+        create_module(os.path.join(source, name), files, size)
+    with open(os.path.join(source, 'synthetic_2024-01.zim'), 'wb') as f:
+        f.write(os.urandom(ZIM_SIZE))
+
+    runs = {}
+    daemon, rsync_port = start_rsync(source, workdir) if shutil.which('rsync') else (None, None)
+    http, http_port = start_http(source)
+    try:
+        for i in range(repeat):
+            print(f'Run {i + 1} of {repeat}...', file=sys.stderr)
+            if daemon:
+                for name in MODULES:
+                    for phase, seconds in bench_rsync_module(name, rsync_port, target).items():
+                        runs.setdefault(f'{name}/{phase}', []).append(seconds)
+            if shutil.which('wget'):
+                for phase, seconds in bench_zim_module(http_port, target).items():
+                    runs.setdefault(f'en-synthetic-zim/{phase}', []).append(seconds)
+    finally:
+        http.shutdown()
+        if daemon:
+            daemon.terminate()
+            daemon.wait()
+
+    results = {}
+    for key, samples in runs.items():
+        samples = [sample for sample in samples if sample is not None]
+        results[key] = round(statistics.median(samples), 4) if samples else None
+    return results
+
+def compare(results, baseline, threshold):
+    ''' Return the benchmarks that are slower than the baseline by more than threshold percent
+    '''
+    regressions = {}
+    for key, seconds in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if seconds is None or not previous:
+            continue
+        change = (seconds - previous) / previous * 100
+        if change > threshold:
+            regressions[key] = { 'baseline':previous, 'seconds':seconds, 'change_percent':round(change, 1) }
+    return regressions
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Benchmark the ARCHIE Pi module install and remove paths')
+    parser.add_argument("--repeat", dest="repeat", help="number of runs of each benchmark (the median is reported)",
+                        type=int, required=False, default=3)
+    parser.add_argument("--workdir", dest="workdir", help="folder for the synthetic modules (default: a temporary folder)",
+                        type=str, required=False, default=None)
+    parser.add_argument("--baseline", dest="baseline", help="results of an earlier run to compare against",
+                        type=str, required=False, default=None)
+    parser.add_argument("--threshold", dest="threshold", help="slowdown (in percent) reported as a regression",
+                        type=float, required=False, default=20)
+    parser.add_argument("--output", dest="output", help="write the JSON results to a file",
+                        type=str, required=False, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='archie-bench-', dir=args.workdir)
+    try:
+        report = { 'results':run(args.repeat, workdir) }
+    finally:
+        shutil.rmtree(workdir)
+    report['skipped'] = [f'{program} benchmarks ({program} is not installed)'
+                         for program in ['rsync', 'wget', 'lynx'] if not shutil.which(program)]
+
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report['results'], json.load(f), args.threshold)
+        report['regressions'] = regressions
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(f'{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold}%')
@@ -0,0 +1,43 @@
+# Commands used to install content modules on the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education).
+#
+# The commands are shared by install-modules.py and bench-modules.py so that the
+# benchmarks always time exactly what the installer runs.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import storage
+
+# rsync server with the RACHEL modules
+RACHEL_URL = 'rsync://dev.worldpossible.org/rachelmods'
+
+def rsync_module(name, source=RACHEL_URL, target=storage.MODULES_DIR):
+    ''' Return the command that downloads a RACHEL module (following links to other storage)
+    '''
+    return f'rsync -PazK --info=progress2 --info=name0 {source}/{name} {target}'
+
+def list_files(url):
+    ''' Return the command that lists the files linked from a web page (such as the kiwix download folders)
+    '''
+    return f'lynx -dump -listonly -nonumbers {url}'
+
+def download(url, file):
+    ''' Return the command that downloads a file (such as a ZIM file)
+    '''
+    return f'wget --no-check-certificate -nv --show-progress -O {file} {url}'
+
+def set_owner(path, owner='www-data.www-data'):
+    ''' Return the command that sets the ownership of a module
+    '''
+    return f'chown -R {owner} {path}'
+
+def set_permissions(path):
+    ''' Return the command that sets the permissions of a module
+    '''
+    return f'chmod -R 755 {path}'
@@ -12,18 +12,102 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import argparse
 import sys
 import curses
 from curses import wrapper
+import json
 import os
-import psutil
+import re
+import resource
+import storage
+import commands
 import subprocess
+import time
+
+# Installation phase of each command (used by --profile)
+PHASES = { 'lynx':'catalog', 'rsync':'transfer', 'wget':'transfer', 'git':'transfer', 'kiwix-manage':'kiwix-manage',
+           'chown':'permissions', 'chmod':'permissions', 'mkdir':'filesystem', 'mv':'filesystem', 'rm':'filesystem',
+           'mount':'remount', 'ntpdate':'time sync', 'archie-kiwix-reload':'kiwix reload' }
+
+class Profiler:
+    ''' Record the time, network bytes, process spawns and filesystem operations
+        of every installation phase and save them as a Chrome trace (chrome://tracing)
+    '''
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.module = 'Preparation'
+        self.events = []
+        self.start = time.perf_counter()
+
+    def counters(self):
+        ''' Return (time, bytes received, blocks read, blocks written, processes started)
+            for this process and its children (processes are counted system wide)
+        '''
+        import psutil   # loaded only when profiling to keep the installer quick to start
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with open('/proc/stat', 'r') as f:
+            processes = next(int(line.split()[1]) for line in f if line.startswith('processes '))
+        return (time.perf_counter(), psutil.net_io_counters().bytes_recv, usage.ru_inblock, usage.ru_oublock, processes)
+
+    def run(self, cmd, function):
+        ''' Run a function that spawns the given command and record it as a phase
+        '''
+        before = self.counters()
+        result = function()
+        after = self.counters()
+        program = os.path.basename(cmd.split()[0])
+        self.events.append({ 'name':PHASES.get(program, program), 'cat':self.module, 'ph':'X', 'pid':1, 'tid':1,
+                             'ts':round((before[0] - self.start) * 1e6), 'dur':round((after[0] - before[0]) * 1e6),
+                             'args':{ 'command':cmd, 'spawns':after[4] - before[4], 'bytes':after[1] - before[1],
+                                      'blocks_read':after[2] - before[2], 'blocks_written':after[3] - before[3] } })
+        return result
+
+    def summary(self):
+        ''' Return the totals for each module and phase
+        '''
+        summary = {}
+        for event in self.events:
+            phase = summary.setdefault(event['cat'], {}).setdefault(event['name'],
+                        { 'seconds':0.0, 'spawns':0, 'bytes':0, 'blocks_read':0, 'blocks_written':0 })
+            phase['seconds'] += event['dur'] / 1e6
+            for key in ['spawns', 'bytes', 'blocks_read', 'blocks_written']:
+                phase[key] += event['args'][key]
+        for phases in summary.values():
+            for phase in phases.values():
+                phase['seconds'] = round(phase['seconds'], 3)
+                phase['mb_per_second'] = round(phase['bytes'] / 2**20 / phase['seconds'], 2) if phase['seconds'] else 0.0
+        return summary
+
+    def report(self):
+        ''' Print a summary of the profile and write the Chrome trace file
+        '''
+        if not self.events:
+            return
+        summary = self.summary()
+        print('\nInstallation profile:')
+        for module, phases in summary.items():
+            print(f'  {module}:')
+            for name, phase in phases.items():
+                print(f"    {name:<14} {phase['seconds']:9.2f}s {phase['spawns']:4} spawns {phase['bytes']/2**20:10.1f}MB "
+                      f"({phase['mb_per_second']:.2f}MB/s) {phase['blocks_read']} blocks read, {phase['blocks_written']} blocks written")
+        try:
+            with open(self.trace_file, 'w') as f:
+                json.dump({ 'traceEvents':self.events, 'displayTimeUnit':'ms', 'otherData':summary }, f, indent=1)
+        except OSError as e:
+            print(f'Unable to write trace to {self.trace_file}: {e}')
+            return
+        print(f'Trace written to {self.trace_file} (open with chrome://tracing or https://ui.perfetto.dev).')
+
+# Profiler used when the installer is run with --profile
+profiler = None
 
 # Helper functions
 def do(cmd):
     ''' Execute system command and return result
     '''
-    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    run = lambda: subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    result = profiler.run(cmd, run) if profiler else run()
     return (result.returncode == 0)
 
 def append_file(file, line):
@@ -37,13 +121,35 @@ def append_file(file, line):
         return False
     return True
 
+def get_free_space():
+    ''' Return the free space on the root partition in GB
+    '''
+    stats = os.statvfs('/')
+    return (stats.f_bavail * stats.f_frsize)//(2**30)
+
+def clear_page_cache():
+    ''' Clear the nginx cache of the landing page so that module changes show up right away
+    '''
+    for root, dirs, files in os.walk('/tmp/nginx-cache'):
+        for file in files:
+            os.remove(os.path.join(root, file))
+
+def get_size(label):
+    ''' Return the approximate size in bytes given in a module label such as "Scratch (254MB)"
+    '''
+    match = re.search(r'\(([\d.]+)(MB|GB)\)$', label)
+    if match is None:
+        return 0
+    return int(float(match.group(1)) * 2**(20 if match.group(2) == 'MB' else 30))
+
 def get_latest_kiwix_filename(filename_prefix, url):
     ''' Kiwix zim files are constantly being updated to more recent versions.
         This function determines the latest zim filename for a given zim filename prefix.
         Zim filenames are assumed to end with a date in the form YYYY-MM-DD
     '''
-    cmd = f'lynx -dump -listonly -nonumbers {url}'
-    result = subprocess.run(cmd.split(), stdout=subprocess.PIPE)
+    cmd = commands.list_files(url)
+    run = lambda: subprocess.run(cmd.split(), stdout=subprocess.PIPE)
+    result = profiler.run(cmd, run) if profiler else run()
     files = result.stdout.decode('utf-8')
     files_list = files.split('\n')
     matching_filenames = []   # list of matching filenames
@@ -69,12 +175,29 @@ def main(screen):
                 'A':'PhET Simulations (English) (66MB)', 'B':'PhET Simulations (Spanish) (69MB)', 'C':'PhET Simulations (French) (68MB)',
                 'S':'Science Made Easy videos (1.7GB)' }
 
+    # module folder for each module
+    MODULE_DIRS = { 'a':'en-algebra2go', 'b':'en-blockly-games', 'c':'en-ck12', 'd':'en-boundless-static', 'e':'en-mustardseedbooks',
+                    'f':'en-ebooks', 'g':'en-worldmap-10', 'h':'en-openstax', 'i':'en-rpi_guide',
+                    'j':'en-scratch', 'k':'en-kaos', 'l':'es-kaos',
+                    'm':'en-wikipedia_for_schools-static', 'n':'en-wikipedia', 'o':'es-wikipedia', 'p':'fr-wikipedia',
+                    'q':'en-wiktionary', 'r':'es-wiktionary', 's':'fr-wiktionary',
+                    't':'en-vikidia', 'u':'es-vikidia', 'v':'fr-vikidia', 'w':'en-kuyers-cer',
+                    'x':'en-wikivoyage', 'y':'es-wikivoyage', 'z':'fr-wikivoyage',
+                    'A':'en-phet', 'B':'es-phet', 'C':'fr-phet',
+                    'S':'en-science-made-easy' }
+
     # root URL for Kiwix resources
     KIWIX_URL = 'http://download.kiwix.org/zim/'
 
+    # modules served by kiwix (installing these requires a kiwix library reload)
+    KIWIX_SELECTIONS = 'nopqrstuvxyzABC'
+
     # Set home folder location (username may be different than the default pi)
     HOME = f'/home/{os.getlogin()}'
 
+    # free space does not change while modules are being selected, so only check it once
+    free_space = get_free_space()
+
     selections = ''
     try:
         while True:
@@ -92,7 +215,7 @@ def main(screen):
                 else:
                     column = 5
                     row += 1
-            screen.addstr(row+2, 5, f"Type the letter(s) for the module(s) you wish to install ({(psutil.disk_usage('/').free)//(2**30)}GB free).")
+            screen.addstr(row+2, 5, f"Type the letter(s) for the module(s) you wish to install ({free_space}GB free).")
             screen.addstr(row+3, 5, 'To quit, press "ctrl-c", to begin installation, press ENTER')
             screen.refresh()
             
@@ -129,226 +252,253 @@ def main(screen):
 
     # Install the selected modules from various open education resources
     for selection in selections:
+        if profiler:
+            profiler.module = OPTIONS[selection]
+        # choose the storage for the module (modules on other storage are linked into /var/www/modules)
+        storage.place_module(MODULE_DIRS[selection], get_size(OPTIONS[selection]))
         if selection == 'm':     # Wikipedia for schools (static version does not require kiwix)
             print('Installing Wikipedia for schools...')
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-wikipedia_for_schools-static /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-wikipedia_for_schools-static')) or sys.exit('Error installing content')
         elif selection == 'n':
             print('Installing Wikipedia (English)...')
-            do('mkdir /var/www/modules/en-wikipedia')
+            do('mkdir -p /var/www/modules/en-wikipedia')
             kiwix_url = KIWIX_URL + 'wikipedia'
             # use the "simple mini" version with smaller ZIM file to accommodate limited memory of Raspberry Pi
             filename = get_latest_kiwix_filename('wikipedia_en_simple_all_mini_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/en-wikipedia/en-wikipedia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/en-wikipedia/en-wikipedia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/en-wikipedia/en-wikipedia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/en-wikipedia">Wikipedia (English)</a></h2>\n</div>'
             append_file('/var/www/modules/en-wikipedia/index.htmlf', html)
         elif selection == 'o':
             print('Installing Wikipedia (Spanish)...')
-            do('mkdir /var/www/modules/es-wikipedia')
+            do('mkdir -p /var/www/modules/es-wikipedia')
             kiwix_url = KIWIX_URL + 'wikipedia'
             # use the "top mini" version with smaller ZIM file to accommodate limited memory of Raspberry Pi
             filename = get_latest_kiwix_filename('wikipedia_es_top_mini_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/es-wikipedia/es-wikipedia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/es-wikipedia/es-wikipedia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/es-wikipedia/es-wikipedia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/es-wikipedia">Wikipedia (Spanish)</a></h2>\n</div>'
             append_file('/var/www/modules/es-wikipedia/index.htmlf', html)
         elif selection == 'p':
             print('Installing Wikipedia (French)...')
-            do('mkdir /var/www/modules/fr-wikipedia')
+            do('mkdir -p /var/www/modules/fr-wikipedia')
             kiwix_url = KIWIX_URL + 'wikipedia'
             # use the "top mini" version with smaller ZIM file to accommodate limited memory of Raspberry Pi
             filename = get_latest_kiwix_filename('wikipedia_fr_top_mini_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/fr-wikipedia/fr-wikipedia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/fr-wikipedia/fr-wikipedia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/fr-wikipedia/fr-wikipedia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/fr-wikipedia">Wikipedia (French)</a></h2>\n</div>'
             append_file('/var/www/modules/fr-wikipedia/index.htmlf', html)
         elif selection == 'q':
             print('Installing Wiktionary (English)...')
-            do('mkdir /var/www/modules/en-wiktionary')
+            do('mkdir -p /var/www/modules/en-wiktionary')
             kiwix_url = KIWIX_URL + 'wiktionary'
             # use the "simple" version with smaller ZIM file to accommodate limited memory of Raspberry Pi
             filename = get_latest_kiwix_filename('wiktionary_en_simple_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/en-wiktionary/en-wiktionary.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/en-wiktionary/en-wiktionary.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/en-wiktionary/en-wiktionary.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/en-wiktionary">Wiktionary (English)</a></h2>\n</div>'
             append_file('/var/www/modules/en-wiktionary/index.htmlf', html)
         elif selection == 'r':
             print('Installing Wiktionary (Spanish)...')
-            do('mkdir /var/www/modules/es-wiktionary')
+            do('mkdir -p /var/www/modules/es-wiktionary')
             kiwix_url = KIWIX_URL + 'wiktionary'
             filename = get_latest_kiwix_filename('wiktionary_es_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/es-wiktionary/es-wiktionary.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/es-wiktionary/es-wiktionary.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/es-wiktionary/es-wiktionary.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/es-wiktionary">Wiktionary (Spanish)</a></h2>\n</div>'
             append_file('/var/www/modules/es-wiktionary/index.htmlf', html)
         elif selection == 's':
             print('Installing Wiktionary (French)...')
-            do('mkdir /var/www/modules/fr-wiktionary')
+            do('mkdir -p /var/www/modules/fr-wiktionary')
             kiwix_url = KIWIX_URL + 'wiktionary'
             filename = get_latest_kiwix_filename('wiktionary_fr_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/fr-wiktionary/fr-wiktionary.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/fr-wiktionary/fr-wiktionary.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/fr-wiktionary/fr-wiktionary.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/fr-wiktionary">Wiktionary (French)</a></h2>\n</div>'
             append_file('/var/www/modules/fr-wiktionary/index.htmlf', html)
         elif selection == 't':
             print('Installing Vikidia (English)...')
-            do('mkdir /var/www/modules/en-vikidia')
+            do('mkdir -p /var/www/modules/en-vikidia')
             kiwix_url = KIWIX_URL + 'vikidia'
             filename = get_latest_kiwix_filename('vikidia_en_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/en-vikidia/en-vikidia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/en-vikidia/en-vikidia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/en-vikidia/en-vikidia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/en-vikidia">Vikidia (English)</a></h2>\n</div>'
             append_file('/var/www/modules/en-vikidia/index.htmlf', html)
         elif selection == 'u':
             print('Installing Vikidia (Spanish)...')
-            do('mkdir /var/www/modules/es-vikidia')
+            do('mkdir -p /var/www/modules/es-vikidia')
             kiwix_url = KIWIX_URL + 'vikidia'
             filename = get_latest_kiwix_filename('vikidia_es_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/es-vikidia/es-vikidia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/es-vikidia/es-vikidia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/es-vikidia/es-vikidia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/es-vikidia">Vikidia (Spanish)</a></h2>\n</div>'
             append_file('/var/www/modules/es-vikidia/index.htmlf', html)
         elif selection == 'v':
             print('Installing Vikidia (French)...')
-            do('mkdir /var/www/modules/fr-vikidia')
+            do('mkdir -p /var/www/modules/fr-vikidia')
             kiwix_url = KIWIX_URL + 'vikidia'
             filename = get_latest_kiwix_filename('vikidia_fr_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/fr-vikidia/fr-vikidia.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/fr-vikidia/fr-vikidia.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/fr-vikidia/fr-vikidia.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/fr-vikidia">Vikidia (French)</a></h2>\n</div>'
             append_file('/var/www/modules/fr-vikidia/index.htmlf', html)
         elif selection == 'x':
             print('Installing Wikivoyage (English)...')
-            do('mkdir /var/www/modules/en-wikivoyage')
+            do('mkdir -p /var/www/modules/en-wikivoyage')
             kiwix_url = KIWIX_URL + 'wikivoyage'
             filename = get_latest_kiwix_filename('wikivoyage_en_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/en-wikivoyage/en-wikivoyage.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/en-wikivoyage/en-wikivoyage.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/en-wikivoyage/en-wikivoyage.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/en-wikivoyage">Wikivoyage (English)</a></h2>\n</div>'
             append_file('/var/www/modules/en-wikivoyage/index.htmlf', html)
         elif selection == 'y':
             print('Installing Wikivoyage (Spanish)...')
-            do('mkdir /var/www/modules/es-wikivoyage')
+            do('mkdir -p /var/www/modules/es-wikivoyage')
             kiwix_url = KIWIX_URL + 'wikivoyage'
             filename = get_latest_kiwix_filename('wikivoyage_es_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/es-wikivoyage/es-wikivoyage.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/es-wikivoyage/es-wikivoyage.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/es-wikivoyage/es-wikivoyage.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/es-wikivoyage">Wikivoyage (Spanish)</a></h2>\n</div>'
             append_file('/var/www/modules/es-wikivoyage/index.htmlf', html)
         elif selection == 'z':
             print('Installing Wikivoyage (French)...')
-            do('mkdir /var/www/modules/fr-wikivoyage')
+            do('mkdir -p /var/www/modules/fr-wikivoyage')
             kiwix_url = KIWIX_URL + 'wikivoyage'
             filename = get_latest_kiwix_filename('wikivoyage_fr_all_maxi_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/fr-wikivoyage/fr-wikivoyage.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/fr-wikivoyage/fr-wikivoyage.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/fr-wikivoyage/fr-wikivoyage.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/fr-wikivoyage">Wikivoyage (French)</a></h2>\n</div>'
             append_file('/var/www/modules/fr-wikivoyage/index.htmlf', html)
         elif selection == 'A':
             print('Installing PhET Simulations (English)...')
-            do('mkdir /var/www/modules/en-phet')
+            do('mkdir -p /var/www/modules/en-phet')
             kiwix_url = KIWIX_URL + 'phet'
             filename = get_latest_kiwix_filename('phet_en_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/en-phet/en-phet.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/en-phet/en-phet.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/en-phet/en-phet.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/en-phet">PhET Interactive Simulations (English)</a></h2>\n</div>'
             append_file('/var/www/modules/en-phet/index.htmlf', html)
         elif selection == 'B':
             print('Installing PhET Simulations (Spanish)...')
-            do('mkdir /var/www/modules/es-phet')
+            do('mkdir -p /var/www/modules/es-phet')
             kiwix_url = KIWIX_URL + 'phet'
             filename = get_latest_kiwix_filename('phet_es_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/es-phet/es-phet.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/es-phet/es-phet.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/es-phet/es-phet.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/es-phet">PhET Interactive Simulations (Spanish)</a></h2>\n</div>'
             append_file('/var/www/modules/es-phet/index.htmlf', html)
         elif selection == 'C':
             print('Installing PhET Simulations (French)...')
-            do('mkdir /var/www/modules/fr-phet')
+            do('mkdir -p /var/www/modules/fr-phet')
             kiwix_url = KIWIX_URL + 'phet'
             filename = get_latest_kiwix_filename('phet_fr_',kiwix_url)
             print(f'Downloading {filename}...')
-            do(f'wget --no-check-certificate -nv --show-progress -O /var/www/modules/fr-phet/fr-phet.zim {filename}')
+            do(commands.download(filename, '/var/www/modules/fr-phet/fr-phet.zim'))
             do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml add /var/www/modules/fr-phet/fr-phet.zim')
             html = '<div class="indexmodule">\n<h2><a href="http://<?php echo $_SERVER["SERVER_ADDR"]?>:81/fr-phet">PhET Interactive Simulations (French)</a></h2>\n</div>'
             append_file('/var/www/modules/fr-phet/index.htmlf', html)
         elif selection == 'a':
             print("Installing Algebra2Go (English)...")
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-algebra2go /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-algebra2go')) or sys.exit('Error installing content')
         elif selection == 'b':
             print("Installing Blockly games (English)...")
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-blockly-games /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-blockly-games')) or sys.exit('Error installing content')
         elif selection == 'c':
             print('Installing CK-12...')
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-ck12 /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-ck12')) or sys.exit('Error installing content')
         elif selection == 'd':
             print('Installing Boundless...')
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-boundless-static /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-boundless-static')) or sys.exit('Error installing content')
         elif selection == 'e':
             print('Installing Mustard Seed Books...')
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-mustardseedbooks /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-mustardseedbooks')) or sys.exit('Error installing content')
         elif selection == 'f':
             print('Installing Project Gutenberg...')
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-ebooks /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-ebooks')) or sys.exit('Error installing content')
         elif selection == 'g':
             print("Installing World Map...")
-            do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-worldmap-10 /var/www/modules') or sys.exit('Error installing content')
+            do(commands.rsync_module('en-worldmap-10')) or sys.exit('Error installing content')
         elif selection == 'k':
             print('Installing Khan Academy (English)...')
-            do("rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-kaos /var/www/modules") or sys.exit('Error installing content')
+            do(commands.rsync_module('en-kaos')) or sys.exit('Error installing content')
         elif selection == 'l':
             print('Installing Khan Academy (Spanish)...')
-            do("rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/es-kaos /var/www/modules") or sys.exit('Error installing content')
+            do(commands.rsync_module('es-kaos')) or sys.exit('Error installing content')
         elif selection == 'h':
             print('Installing openstax Textbooks...')
-            do("rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-openstax /var/www/modules") or sys.exit('Error installing content')
+            do(commands.rsync_module('en-openstax')) or sys.exit('Error installing content')
         elif selection == 'i':
             print('Installing Rasp Pi User Guide...')
-            do("rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-rpi_guide /var/www/modules") or sys.exit('Error installing content')
+            do(commands.rsync_module('en-rpi_guide')) or sys.exit('Error installing content')
         elif selection == 'j':
             print('Installing Scratch...')
-            do("rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-scratch /var/www/modules") or sys.exit('Error installing content')
+            do(commands.rsync_module('en-scratch')) or sys.exit('Error installing content')
         elif selection == 'w':
             print('Installing Kuyers Christian Education Resources...')
-            do('git clone --depth 1 https://github.com/dschuurman/en-kuyers-cer.git') or sys.exit('Error installing content')
-            do('rm -rf en-kuyers-cer/.git')
-            do('mv en-kuyers-cer /var/www/modules') or sys.exit('Error moving content')
+            do('git clone --depth 1 https://github.com/dschuurman/en-kuyers-cer.git /var/www/modules/en-kuyers-cer') or sys.exit('Error installing content')
+            do('rm -rf /var/www/modules/en-kuyers-cer/.git')
         elif selection == 'S':
             print('Installing Science Made Easy videos...')
-            do('git clone --depth 1 https://github.com/dschuurman/science-made-easy.git') or sys.exit('Error installing content')
-            do('rm -rf science-made-easy/.git')
-            do('mv science-made-easy /var/www/modules/en-science-made-easy') or sys.exit('Error moving content')
+            do('git clone --depth 1 https://github.com/dschuurman/science-made-easy.git /var/www/modules/en-science-made-easy') or sys.exit('Error installing content')
+            do('rm -rf /var/www/modules/en-science-made-easy/.git')
+        storage.update_manifest(MODULE_DIRS[selection], { 'name':re.sub(r' \([\d.]+[MG]B\)$', '', OPTIONS[selection]),
+                                                         'kiwix':selection in KIWIX_SELECTIONS, 'installed':int(time.time()) })
         print('Done')
 
     # update ownership and permissions of modules
+    if profiler:
+        profiler.module = 'All modules'
+    # (only the new modules are updated; modules on other storage are updated where they are stored)
     print('Setting module folder permissions and ownerships (this may take a while)...')
-    do('chown -R www-data.www-data /var/www/modules') or sys.exit('Error changing ownership of modules folder to www-data')
-    do('chmod -R 755 /var/www/modules') or sys.exit('Error changing permissions of module files')
+    for selection in selections:
+        module = os.path.realpath(f'/var/www/modules/{MODULE_DIRS[selection]}')
+        do(commands.set_owner(module)) or sys.exit('Error changing ownership of modules folder to www-data')
+        do(commands.set_permissions(module)) or sys.exit('Error changing permissions of module files')
 
-    # restart kiwix server
-    do('pkill -SIGHUP kiwix-serve')   # restart kiwix server
+    # show the new modules on the landing page
+    clear_page_cache()
+
+    # reload kiwix library without dropping requests (on failure the running server is left unchanged)
+    if any(selection in KIWIX_SELECTIONS for selection in selections):
+        do(f'/usr/local/bin/archie-kiwix-reload --kiwix {HOME}/kiwix') or print('Unable to reload the kiwix library; kiwix continues to serve the previous library')
 
     # Once content is installed and configured, return root partition to read-only mode
     do('mount -o remount,ro /')
 
-    print(f"\nDONE! ({(psutil.disk_usage('/').free)//(2**30)}GB free).")
+    print(f"\nDONE! ({get_free_space()}GB free).")
     print('** Each content module is subject to its own license terms and conditions.')
     print('** Note that a reboot is recommended.')
     print("** To reboot, type 'sudo reboot' at the command-line.")
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--profile", dest="profile", help="record the time spent in each installation phase",
+                    action='store_true')
+parser.add_argument("--trace", dest="trace", help="trace file written by --profile (Chrome trace format)",
+                    type=str, required=False, default='/tmp/install-profile.json')
+args = parser.parse_args()
+if args.profile:
+    profiler = Profiler(args.trace)
+
 # Use wrapper function to ensure original state of terminal is restored on exit
-wrapper(main)
+try:
+    wrapper(main)
+finally:
+    # the profile is also reported when the installation stops with an error
+    if profiler:
+        profiler.report()
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# Script to reload the Kiwix library of the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education)
+# without dropping requests that are currently being served.
+#
+# nginx listens on port 81 and forwards requests to kiwix-serve, which listens
+# on one of two internal ports. A reload validates the library, starts a new
+# kiwix-serve on the spare port, waits until it answers, points nginx at it and
+# finally stops the old instance once in-flight requests have drained.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import os
+import re
+import sys
+import subprocess
+import time
+import urllib.request
+import xml.etree.ElementTree as ET
+
+# Internal ports used alternately by kiwix-serve (nginx serves port 81)
+KIWIX_PORTS = (8081, 8082)
+
+# nginx upstream file that selects the active kiwix-serve instance
+UPSTREAM_FILE = '/etc/nginx/kiwix-upstream.conf'
+
+# Helper functions
+def do(cmd):
+    ''' Show and execute system command and return result
+    '''
+    print(f'-> {cmd}')
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def get_kiwix_home():
+    ''' Return the kiwix folder (username may be different than the default pi)
+    '''
+    user = os.environ.get('SUDO_USER') or os.getlogin()
+    return f'/home/{user}/kiwix'
+
+def validate_library(library):
+    ''' Check that the kiwix XML library can be parsed and that every ZIM file it
+        lists exists. Returns a list of problems (empty if the library is valid).
+    '''
+    try:
+        # setup.py creates the library as an empty file, which lists no books
+        if os.path.getsize(library) == 0:
+            return []
+        root = ET.parse(library).getroot()
+    except (ET.ParseError, OSError) as e:
+        return [f'unable to parse {library}: {e}']
+    if root.tag != 'library':
+        return [f'unexpected root element <{root.tag}> in {library}']
+    problems = []
+    for book in root.findall('book'):
+        path = book.get('path')
+        if path is None:
+            problems.append(f'book {book.get("id")} has no path')
+            continue
+        # Relative paths in the library are relative to the library file
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(library), path)
+        if not os.path.isfile(path):
+            problems.append(f'book {book.get("id")} refers to missing file {path}')
+    return problems
+
+def get_active_port():
+    ''' Return the kiwix-serve port that nginx currently forwards to
+    '''
+    try:
+        with open(UPSTREAM_FILE, 'r') as f:
+            match = re.search(r'server\s+127\.0\.0\.1:(\d+)', f.read())
+    except FileNotFoundError:
+        return KIWIX_PORTS[0]
+    if match is None:
+        return KIWIX_PORTS[0]
+    return int(match.group(1))
+
+def write_upstream(port):
+    ''' Point the nginx kiwix upstream at the given port
+    '''
+    try:
+        with open(UPSTREAM_FILE, 'w') as f:
+            f.write('# Generated by kiwix-reload.py; selects the active kiwix-serve instance\n')
+            f.write(f'upstream kiwix {{\n\tserver 127.0.0.1:{port};\n}}\n')
+    except OSError:
+        print(f'unable to write {UPSTREAM_FILE}')
+        return False
+    return True
+
+def start_kiwix(kiwix, port):
+    ''' Start a kiwix-serve daemon on a local port
+    '''
+    return do(f'{kiwix}/kiwix-serve --library --address 127.0.0.1 --port {port} --blockexternal --nolibrarybutton --daemon {kiwix}/library_zim.xml')
+
+def stop_kiwix(port):
+    ''' Stop the kiwix-serve daemon listening on a given port
+    '''
+    print(f'-> stopping kiwix-serve on port {port}')
+    result = subprocess.run(['pkill', '-f', f'kiwix-serve .*--port {port} '])
+    return (result.returncode == 0)
+
+def is_healthy(port, timeout):
+    ''' Poll a kiwix-serve instance until it answers or the timeout expires
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def boot(kiwix):
+    ''' Start kiwix-serve on the port nginx is configured to use (run from rc.local)
+    '''
+    return start_kiwix(kiwix, get_active_port())
+
+def reload(kiwix, timeout, drain):
+    ''' Switch kiwix-serve over to the current library without downtime
+    '''
+    library = f'{kiwix}/library_zim.xml'
+    problems = validate_library(library)
+    if problems:
+        for problem in problems:
+            print(f'Error: {problem}')
+        print('Kiwix library not reloaded; the running server is unchanged.')
+        return False
+
+    old_port = get_active_port()
+    new_port = KIWIX_PORTS[1] if old_port == KIWIX_PORTS[0] else KIWIX_PORTS[0]
+
+    # Stop any instance left behind on the spare port by an interrupted reload
+    stop_kiwix(new_port)
+    print(f'Starting kiwix-serve on spare port {new_port}...')
+    if not start_kiwix(kiwix, new_port) or not is_healthy(new_port, timeout):
+        print(f'Error: kiwix-serve on port {new_port} did not become healthy; keeping port {old_port}.')
+        stop_kiwix(new_port)
+        return False
+
+    # Switch nginx over; a reload lets old workers finish their current requests
+    write_upstream(new_port) or sys.exit('Error: unable to update nginx upstream')
+    if not do('nginx -t -q'):
+        write_upstream(old_port)
+        stop_kiwix(new_port)
+        print('Error: nginx rejected the new upstream; keeping the previous kiwix-serve.')
+        return False
+    do('nginx -s reload') or sys.exit('Error: unable to reload nginx')
+
+    # Give requests proxied to the old instance time to complete before stopping it
+    print(f'Waiting {drain}s for requests to drain from port {old_port}...')
+    time.sleep(drain)
+    stop_kiwix(old_port)
+    return True
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Reload the ARCHIE Pi kiwix library without downtime')
+    parser.add_argument("--boot", dest="boot", help="start kiwix-serve on the active port (used at startup)",
+                        action='store_true')
+    parser.add_argument("--kiwix", dest="kiwix", help="kiwix folder containing kiwix-serve and library_zim.xml",
+                        type=str, required=False, default=None)
+    parser.add_argument("--timeout", dest="timeout", help="seconds to wait for the new instance to become healthy",
+                        type=int, required=False, default=30)
+    parser.add_argument("--drain", dest="drain", help="seconds to let the old instance finish in-flight requests",
+                        type=int, required=False, default=10)
+    args = parser.parse_args()
+
+    # Check to ensure we are running with root privileges
+    if os.getuid() != 0:
+        sys.exit(f"Please run this script as root.")
+
+    kiwix = args.kiwix or get_kiwix_home()
+    if args.boot:
+        boot(kiwix) or sys.exit('Error: unable to start kiwix-serve')
+    else:
+        reload(kiwix, args.timeout, args.drain) or sys.exit(1)
+        print('Kiwix library reloaded.')
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+# Load-test tool for the ARCHIE Pi (Another Remote Community Hotspot for Instruction and Education).
+# Simulates a classroom of clients browsing the landing page, static modules, kiwix articles
+# and searches, and videos (using range requests), then reports throughput, latency
+# percentiles and error rates as JSON so that configurations and hardware can be compared.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Share of requests for each kind of traffic (kinds without any targets are skipped)
+TRAFFIC_MIX = { 'landing':0.25, 'module':0.30, 'kiwix-article':0.20, 'kiwix-search':0.10, 'video':0.15 }
+
+# Words used for simulated kiwix searches
+SEARCH_WORDS = ['water', 'history', 'energy', 'africa', 'fraction', 'plant', 'river', 'music', 'health', 'planet']
+
+# Size of each simulated video range request
+VIDEO_CHUNK = 2**20
+
+# Largest number of articles requested from each kiwix book
+ARTICLES_PER_BOOK = 50
+
+# Helper functions
+def percentile(values, p):
+    ''' Return the p-th percentile of a sorted list using the nearest-rank method
+    '''
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))   # ceiling of len*p/100
+    return values[int(rank) - 1]
+
+def fetch(url, headers=None, timeout=30):
+    ''' Request a url and return (status, bytes received)
+    '''
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, len(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, 0
+
+def discover_articles(kiwix_url, book):
+    ''' Return article urls of a kiwix book, found on its main page and in search results
+    '''
+    articles = set()
+    pages = [f'{kiwix_url}/{book}/'] + [f'{kiwix_url}/search?content={book}&pattern={word}' for word in SEARCH_WORDS[:3]]
+    for page in pages:
+        try:
+            with urllib.request.urlopen(page, timeout=30) as response:
+                # the main page of a book redirects to its main article
+                base = response.url
+                html = response.read().decode('utf-8', errors='replace')
+        except (OSError, http.client.HTTPException):
+            continue
+        if page == pages[0]:
+            articles.add(base)
+        for href in re.findall(r'href="([^"#]+)', html):
+            article = urllib.parse.urljoin(base, href)
+            path = urllib.parse.urlsplit(article).path
+            if article.startswith(kiwix_url + '/') and f'/{book}/' in path and not re.search(r'/(search|suggest|catalog|skin)\b', path):
+                articles.add(article)
+    return sorted(articles)[:ARTICLES_PER_BOOK]
+
+def discover_targets(url, kiwix_url, videos):
+    ''' Build the list of request targets for each kind of traffic from the landing page
+    '''
+    with urllib.request.urlopen(url + '/', timeout=30) as response:
+        page = response.read().decode('utf-8', errors='replace')
+    modules, books = set(), set()
+    for href in re.findall(r'href="([^"]+)"', page):
+        if re.search(r':81/', href):
+            # kiwix links are of the form http://<address>:81/<book>
+            books.add(href.split(':81/', 1)[1].strip('/').split('/')[0])
+        elif href.startswith('/modules/') or href.startswith('modules/'):
+            modules.add('/' + href.lstrip('/'))
+    books.discard('')
+
+    targets = { 'landing':[(url + '/', None)],
+                'module':[(url + path, None) for path in sorted(modules)],
+                'kiwix-article':[(article, None) for book in sorted(books) for article in discover_articles(kiwix_url, book)],
+                'kiwix-search':[(f'{kiwix_url}/search?content={book}&pattern={word}', None)
+                                for book in sorted(books) for word in SEARCH_WORDS],
+                'video':[] }
+    # Videos are requested in chunks, so the size of each video is needed
+    for video in videos:
+        video_url = url + '/' + video.lstrip('/')
+        request = urllib.request.Request(video_url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=30) as response:
+            size = int(response.headers.get('Content-Length', 0))
+        if size > 0:
+            targets['video'].append((video_url, size))
+    return targets
+
+def client(targets, deadline, think, seed, results, lock):
+    ''' Simulated client: issue requests according to the traffic mix until the deadline
+    '''
+    rng = random.Random(seed)
+    kinds = [kind for kind in TRAFFIC_MIX if targets[kind]]
+    weights = [TRAFFIC_MIX[kind] for kind in kinds]
+    samples = []
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        url, size = rng.choice(targets[kind])
+        headers = None
+        if size is not None:
+            start = rng.randrange(0, max(1, size - VIDEO_CHUNK))
+            headers = { 'Range':f'bytes={start}-{min(size, start + VIDEO_CHUNK) - 1}' }
+        begin = time.monotonic()
+        try:
+            status, received = fetch(url, headers)
+            error = status >= 400
+        except (OSError, http.client.HTTPException):
+            # connection failures and truncated responses of an overloaded server
+            status, received, error = None, 0, True
+        samples.append((kind, time.monotonic() - begin, received, error))
+        if think > 0:
+            time.sleep(rng.expovariate(1 / think))
+    with lock:
+        results.extend(samples)
+
+def summarize(samples, elapsed):
+    ''' Return throughput, latency percentiles and error rate for a set of samples
+    '''
+    latencies = sorted(latency for _, latency, _, _ in samples)
+    errors = sum(1 for _, _, _, error in samples if error)
+    received = sum(size for _, _, size, _ in samples)
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return { 'requests':len(samples),
+             'errors':errors,
+             'error_rate':round(errors / len(samples), 4) if samples else 0.0,
+             'requests_per_second':round(len(samples) / elapsed, 2),
+             'bytes_per_second':round(received / elapsed),
+             'latency_ms':{ 'p50':ms(percentile(latencies, 50)),
+                            'p95':ms(percentile(latencies, 95)),
+                            'p99':ms(percentile(latencies, 99)),
+                            'max':ms(latencies[-1] if latencies else None) } }
+
+def run(targets, clients, duration, think, seed):
+    ''' Run the simulated clients and return the JSON report
+    '''
+    results, lock = [], threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=client, args=(targets, deadline, think, seed + i, results, lock))
+               for i in range(clients)]
+    begin = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - begin
+
+    report = { 'clients':clients, 'duration_s':round(elapsed, 2), 'think_s':think,
+               'targets':{ kind:len(targets[kind]) for kind in TRAFFIC_MIX },
+               'total':summarize(results, elapsed), 'by_kind':{} }
+    for kind in TRAFFIC_MIX:
+        samples = [sample for sample in results if sample[0] == kind]
+        if samples:
+            report['by_kind'][kind] = summarize(samples, elapsed)
+    return report
+
+#########################################################
+# Local stand-in server with synthetic module fixtures
+#########################################################
+# Number of results of a simulated kiwix search (and articles in each synthetic book)
+SEARCH_RESULTS = 25
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    ''' Serve fixture files (with range request support) and simulated kiwix searches
+    '''
+    root = '.'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, extra_headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/search':
+            query = urllib.parse.parse_qs(url.query)
+            body = ''.join(f'<li><a href="/{query.get("content", [""])[0]}/A/{i}">{query.get("pattern", [""])[0]} {i}</a></li>'
+                           for i in range(SEARCH_RESULTS))
+            return self.send_body(200, f'<html><body><ul>{body}</ul></body></html>'.encode(), 'text/html')
+
+        path = os.path.join(self.root, urllib.parse.unquote(url.path).lstrip('/'))
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return self.send_body(404, b'Not found', 'text/plain')
+        content_type = 'video/mp4' if path.endswith('.mp4') else 'text/html'
+
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match is None:
+            return self.send_body(200, data, content_type, [('Accept-Ranges', 'bytes')])
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        if start > end:
+            return self.send_body(416, b'', content_type, [('Content-Range', f'bytes */{len(data)}')])
+        self.send_body(206, data[start:end + 1], content_type, [('Content-Range', f'bytes {start}-{end}/{len(data)}')])
+
+def create_fixtures(root, modules, pages, video_mb):
+    ''' Create a synthetic landing page, static modules, kiwix books and a video.
+        As on the ARCHIE Pi, kiwix links on the landing page point at port 81.
+    '''
+    rng = random.Random(0)
+    web, kiwix = os.path.join(root, 'www'), os.path.join(root, 'kiwix')
+    links = []
+    for i in range(modules):
+        # Static module in the style of a RACHEL module with a few content pages
+        name = f'en-module{i}'
+        os.makedirs(os.path.join(web, 'modules', name))
+        for page in range(pages):
+            with open(os.path.join(web, 'modules', name, f'page{page}.html'), 'w') as f:
+                f.write('<html><body>' + ' '.join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(500, 3000))) + '</body></html>')
+        links.append(f'<h2><a href="modules/{name}/page{rng.randrange(pages)}.html">Module {i}</a></h2>')
+        # Kiwix book stand-in: a main page linking to articles (also returned by the simulated search)
+        book = f'en-book{i}'
+        os.makedirs(os.path.join(kiwix, book, 'A'))
+        for article in range(SEARCH_RESULTS):
+            with open(os.path.join(kiwix, book, 'A', str(article)), 'w') as f:
+                f.write('<html><body>' + ' '.join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(500, 3000))) + '</body></html>')
+        with open(os.path.join(kiwix, book, 'index.html'), 'w') as f:
+            f.write('<html><body>' + ''.join(f'<p><a href="A/{article}">Article {article}</a></p>' for article in range(0, SEARCH_RESULTS, 3))
+                    + '</body></html>')
+        links.append(f'<h2><a href="http://127.0.0.1:81/{book}">Book {i}</a></h2>')
+    with open(os.path.join(web, 'index.html'), 'w') as f:
+        f.write('<html><body><p>Welcome to the <b>ARCHIE Pi</b>!</p>' + '\n'.join(links) + '</body></html>')
+    os.makedirs(os.path.join(web, 'modules', 'en-videos'))
+    with open(os.path.join(web, 'modules', 'en-videos', 'video.mp4'), 'wb') as f:
+        f.write(os.urandom(video_mb * 2**20))
+    return web, kiwix
+
+def start_server(root):
+    ''' Start a fixture server on a free local port and return the server
+    '''
+    handler = type('Handler', (FixtureHandler,), { 'root':root })
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Simulate classroom traffic against an ARCHIE Pi and report performance as JSON')
+    parser.add_argument("--url", dest="url", help="web server to test",
+                        type=str, required=False, default='http://10.10.10.10')
+    parser.add_argument("--kiwix-url", dest="kiwix_url", help="kiwix server to test (default: web server on port 81)",
+                        type=str, required=False, default=None)
+    parser.add_argument("--video", dest="videos", help="path of a video to request in chunks (may be repeated)",
+                        action='append', default=[])
+    parser.add_argument("--clients", dest="clients", help="number of concurrent simulated clients",
+                        type=int, required=False, default=20)
+    parser.add_argument("--duration", dest="duration", help="test duration in seconds",
+                        type=float, required=False, default=60)
+    parser.add_argument("--think", dest="think", help="mean pause between requests of a client in seconds",
+                        type=float, required=False, default=0)
+    parser.add_argument("--seed", dest="seed", help="random seed for the simulated traffic",
+                        type=int, required=False, default=1)
+    parser.add_argument("--local", dest="local", help="test local stand-in servers with synthetic modules",
+                        action='store_true')
+    parser.add_argument("--modules", dest="modules", help="number of synthetic modules for --local",
+                        type=int, required=False, default=5)
+    parser.add_argument("--video-mb", dest="video_mb", help="size of the synthetic video for --local in MB",
+                        type=int, required=False, default=16)
+    parser.add_argument("--output", dest="output", help="write the JSON report to a file",
+                        type=str, required=False, default=None)
+    args = parser.parse_args()
+
+    fixtures = None
+    if args.local:
+        fixtures = tempfile.mkdtemp(prefix='archie-load-test-')
+        web, kiwix = create_fixtures(fixtures, args.modules, 10, args.video_mb)
+        web_server, kiwix_server = start_server(web), start_server(kiwix)
+        args.url = f'http://127.0.0.1:{web_server.server_address[1]}'
+        args.kiwix_url = f'http://127.0.0.1:{kiwix_server.server_address[1]}'
+        args.videos = args.videos or ['modules/en-videos/video.mp4']
+    kiwix_url = args.kiwix_url or re.sub(r'(:\d+)?/*$', '', args.url) + ':81'
+
+    try:
+        targets = discover_targets(args.url.rstrip('/'), kiwix_url.rstrip('/'), args.videos)
+        print(f'Testing {args.url} with {args.clients} clients for {args.duration}s...', file=sys.stderr)
+        report = run(targets, args.clients, args.duration, args.think, args.seed)
+    except (OSError, http.client.HTTPException) as e:
+        sys.exit(f'Error: unable to reach {args.url}: {e}')
+    finally:
+        if fixtures is not None:
+            shutil.rmtree(fixtures)
+
+    report['url'], report['kiwix_url'] = args.url, kiwix_url
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# Script to summarize the nginx access logs of the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education).
+#
+# The logs live in a small tmpfs (RAM) folder, so they are rotated frequently. This script
+# is run by logrotate before and after each rotation to add the new log entries to a compact
+# summary that is also kept in RAM. With --flush, the summary is appended to a file on a
+# writable partition and the counters are reset, so that usage statistics survive a reboot
+# while writes to storage remain infrequent.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import time
+
+# Access logs to summarize: log file -> kind of traffic
+ACCESS_LOGS = { '/var/log/nginx/access.log':'web', '/var/log/nginx/kiwix-access.log':'kiwix' }
+
+# Summary kept in RAM between flushes
+SUMMARY_FILE = '/var/log/archie-pi/summary.json'
+
+# Lock held while the summary is updated (logrotate and the hourly flush may run at the same time)
+LOCK_FILE = '/var/log/archie-pi/summary.lock'
+
+# nginx "combined" log format: address, request line, status and bytes sent
+LOG_LINE = re.compile(r'^(\S+) \S+ \S+ \[[^\]]+\] "\S+ (\S+)[^"]*" (\d{3}) (\d+|-)')
+
+# Helper functions
+def new_summary():
+    ''' Return an empty summary
+    '''
+    return { 'since':int(time.time()), 'requests':0, 'bytes':0, 'status':{}, 'modules':{}, 'clients':[], 'files':{} }
+
+def load_summary():
+    ''' Load the summary kept in RAM (or start a new one)
+    '''
+    try:
+        with open(SUMMARY_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return new_summary()
+
+def save_summary(summary):
+    ''' Save the summary atomically so a reader never sees a partial file
+    '''
+    os.makedirs(os.path.dirname(SUMMARY_FILE), exist_ok=True)
+    with open(SUMMARY_FILE + '.tmp', 'w') as f:
+        json.dump(summary, f)
+    os.replace(SUMMARY_FILE + '.tmp', SUMMARY_FILE)
+
+def get_module(path, kind):
+    ''' Return the module a request path belongs to (None for other pages)
+    '''
+    parts = path.split('?')[0].strip('/').split('/')
+    if kind == 'web':
+        return parts[1] if len(parts) > 1 and parts[0] == 'modules' else None
+    # kiwix urls are /<book>/... or /content/<book>/... (or /viewer#<book>); books are named after module folders
+    if parts[0] in ['content', 'raw'] and len(parts) > 1:
+        return parts[1]
+    if parts[0] in ['', 'search', 'suggest', 'catalog', 'skin', 'viewer']:
+        return None
+    return parts[0]
+
+def read_log(log, kind, position, summary, clients):
+    ''' Add the entries of a log written after the given position to the summary
+        and return the new position
+    '''
+    stat = os.stat(log)
+    # Start from the beginning of a log that is not the one read last time
+    offset = position['offset'] if position and position['inode'] == stat.st_ino and position['offset'] <= stat.st_size else 0
+    with open(log, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            match = LOG_LINE.match(line.decode('utf-8', errors='replace'))
+            if match is None:
+                continue
+            address, path, status, size = match.groups()
+            summary['requests'] += 1
+            summary['bytes'] += 0 if size == '-' else int(size)
+            summary['status'][status] = summary['status'].get(status, 0) + 1
+            clients.add(address)
+            module = get_module(path, kind)
+            if module is not None:
+                summary['modules'][module] = summary['modules'].get(module, 0) + 1
+        return { 'inode':stat.st_ino, 'offset':f.tell() }
+
+def summarize(summary):
+    ''' Add log entries written since the last run to the summary
+    '''
+    clients = set(summary['clients'])
+    for log, kind in ACCESS_LOGS.items():
+        # On rotation the log is renamed to .1, and nginx adds the entries it still buffers
+        # there when it reopens its logs. Finish reading it if it is a log read before.
+        rotated = log + '.1'
+        try:
+            inode = os.stat(rotated).st_ino
+            position = next((position for position in [summary['files'].get(log), summary['files'].get(rotated)]
+                             if position and position['inode'] == inode), None)
+            if position is not None:
+                summary['files'][rotated] = read_log(rotated, kind, position, summary, clients)
+        except FileNotFoundError:
+            pass
+        try:
+            summary['files'][log] = read_log(log, kind, summary['files'].get(log), summary, clients)
+        except FileNotFoundError:
+            continue
+    summary['clients'] = sorted(clients)
+    return summary
+
+def flush(summary, folder):
+    ''' Append the summary to a file on a writable partition and return a fresh summary
+    '''
+    record = { key:summary[key] for key in ['since', 'requests', 'bytes', 'status', 'modules'] }
+    record['until'] = int(time.time())
+    record['clients'] = len(summary['clients'])
+    try:
+        with open(os.path.join(folder, 'archie-pi-usage.jsonl'), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError as e:
+        print(f'unable to write usage summary to {folder}: {e}')
+        return summary
+    # Keep the log positions so entries are not counted twice
+    fresh = new_summary()
+    fresh['files'] = summary['files']
+    return fresh
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Summarize the ARCHIE Pi access logs')
+    parser.add_argument("--flush", dest="flush", help="append the summary to a folder on a writable partition and reset it",
+                        type=str, required=False, default=None)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    with open(LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        summary = summarize(load_summary())
+        if args.flush:
+            summary = flush(summary, args.flush)
+        save_summary(summary)
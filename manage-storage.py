@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# Script to manage the storage used for content modules of the
+# ARCHIE Pi (Another Remote Community Hotspot for Instruction and Education).
+#
+# Additional storage (such as a USB SSD mounted at /mnt/ssd) can be added as a "fast"
+# or "slow" storage root. The rebalance command moves modules between storage roots so
+# that frequently used and small modules are kept on the fastest storage.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import os
+import sys
+import subprocess
+import storage
+
+# Helper functions
+def do(cmd):
+    ''' Execute system command and return result
+    '''
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def get_modules():
+    ''' Return the names of the installed modules
+    '''
+    with os.scandir(storage.MODULES_DIR) as modules:
+        return sorted(module.name for module in modules if module.is_dir())
+
+def list_storage(args):
+    ''' Show the storage roots and the modules stored on each
+    '''
+    roots = storage.load_roots()
+    hits = storage.get_hits(args.usage)
+    placement = { module:storage.get_module_root(module, roots) for module in get_modules() }
+    for root in roots:
+        print(f"{root['path']} ({root['tier']} storage, {(storage.get_free(root) + storage.RESERVE)//(2**30)}GB free)")
+        for module, location in placement.items():
+            if location is root:
+                print(f"\t{module} ({storage.get_module_size(module)//(2**20)}MB, {hits.get(module, 0)} requests)")
+
+def add_storage(args):
+    ''' Add a storage root
+    '''
+    path = os.path.abspath(args.path)
+    roots = storage.load_roots()
+    if any(root['path'] == path for root in roots):
+        sys.exit(f'{path} is already used for storage')
+    if not os.path.ismount(path):
+        print(f'Warning: {path} is not a mount point; make sure the storage is mounted at startup (in /etc/fstab).')
+    roots.append({ 'path':path, 'tier':args.tier })
+    os.makedirs(storage.get_root_dir(roots[-1]), exist_ok=True)
+    problem = storage.check_filesystem(storage.get_root_dir(roots[-1]))
+    if problem is not None:
+        sys.exit(f'{path} cannot be used for modules ({problem}); format it with a Linux filesystem such as ext4.')
+    do('mount -o remount,rw /')
+    storage.save_roots(roots)
+    do('mount -o remount,ro /')
+    print(f'Added {path} as {args.tier} storage. Run "sudo ./manage-storage.py rebalance" to move modules to it.')
+
+def remove_storage(args):
+    ''' Move all modules off a storage root and stop using it
+    '''
+    path = os.path.abspath(args.path)
+    roots = storage.load_roots()
+    root = next((root for root in roots if root['path'] == path and root is not storage.SD_ROOT), None)
+    if root is None:
+        sys.exit(f'{path} is not used for storage')
+    others = [other for other in roots if other is not root]
+    modules = [module for module in get_modules() if storage.get_module_root(module, roots) is root]
+
+    # Temporarily mount root partion in read-write mode for moving content
+    do('mount -o remount,rw /')
+    for module in modules:
+        if not storage.move_module(module, storage.choose_root(storage.get_module_size(module), others)):
+            do('mount -o remount,ro /')
+            sys.exit(f'Error moving {module}; {path} is still used for storage')
+    if modules:
+        do('/usr/local/bin/archie-kiwix-reload') or print('Unable to reload the kiwix library; kiwix continues to serve the previous library')
+    storage.save_roots(others)
+    do('mount -o remount,ro /')
+    print(f'Removed {path}.')
+
+def rebalance(args):
+    ''' Move modules between storage roots according to their size and use
+    '''
+    roots = storage.load_roots()
+    print('Measuring installed modules (this may take a while)...')
+    sizes = { module:storage.get_module_size(module) for module in get_modules() }
+    placement = storage.plan(sizes, storage.get_hits(args.usage), roots)
+    moves = [(module, root) for module, root in placement.items() if storage.get_module_root(module, roots) is not root]
+    if not moves:
+        print('All modules are already on the best storage.')
+        return
+    for module, root in moves:
+        print(f"{module} ({sizes[module]//(2**20)}MB): {storage.get_module_root(module, roots)['path']} -> {root['path']}")
+    if args.dry_run:
+        return
+
+    # Temporarily mount root partion in read-write mode for moving content
+    do('mount -o remount,rw /')
+    for module, root in moves:
+        storage.move_module(module, root) or print(f'Error moving {module}; it was left in place')
+    # reload kiwix library so kiwix serves ZIM files from their new location
+    do('/usr/local/bin/archie-kiwix-reload') or print('Unable to reload the kiwix library; kiwix continues to serve the previous library')
+    do('mount -o remount,ro /')
+    print('DONE!')
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Manage the storage used for ARCHIE Pi modules')
+    parser.add_argument("--usage", dest="usage", help="usage history saved by the log summary (archie-pi-usage.jsonl)",
+                        type=str, required=False, default=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser('list', help='show storage and the modules stored on each').set_defaults(function=list_storage)
+    add = commands.add_parser('add', help='add storage for modules')
+    add.add_argument("path", help="mount point of the storage")
+    add.add_argument("--tier", dest="tier", help="storage speed", choices=['fast', 'slow'], default='fast')
+    add.set_defaults(function=add_storage)
+    remove = commands.add_parser('remove', help='move modules off storage and stop using it')
+    remove.add_argument("path", help="mount point of the storage")
+    remove.set_defaults(function=remove_storage)
+    balance = commands.add_parser('rebalance', help='move modules between storage by size and use')
+    balance.add_argument("--dry-run", dest="dry_run", help="only show the modules that would be moved", action='store_true')
+    balance.set_defaults(function=rebalance)
+    args = parser.parse_args()
+
+    # Check to ensure we are running with root privileges
+    if os.getuid() != 0:
+        sys.exit(f"Please run this script as root.")
+    args.function(args)
@@ -12,9 +12,8 @@
 
 import sys
 import os
-import psutil
+import storage
 import subprocess
-import xmltodict
 
 # map of directories and corresponding module names
 DIRS_NAMES = { 'en-blockly-games':'Blockly)', 'es-blockly-games':'Blockly (Spanish)', 'en-ck12':'CK-12', 'en-boundless-static':'Boundless', 
@@ -37,15 +36,34 @@ def do(cmd):
     result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
     return (result.returncode == 0)
 
+def get_free_space():
+    ''' Return the free space on the root partition in GB
+    '''
+    stats = os.statvfs('/')
+    return (stats.f_bavail * stats.f_frsize)//(2**30)
+
+def clear_page_cache():
+    ''' Clear the nginx cache of the landing page so that module changes show up right away
+    '''
+    for root, dirs, files in os.walk('/tmp/nginx-cache'):
+        for file in files:
+            os.remove(os.path.join(root, file))
+
+# sizes of module directories already measured (measuring a large module is slow)
+dir_sizes = {}
+
 def get_dir_size(path):
     ''' Return the size of a directory
     '''
-    size = subprocess.check_output(['du','-sh', path]).split()[0].decode('utf-8')
-    return size
+    if path not in dir_sizes:
+        # measure where the module is stored (it may be linked from other storage)
+        dir_sizes[path] = subprocess.check_output(['du','-sh', os.path.realpath(path)]).split()[0].decode('utf-8')
+    return dir_sizes[path]
 
 def get_zim_id(zim_file):
     ''' Return the ZIM ID for an installed ZIM module
     '''
+    import xmltodict   # only needed when removing a kiwix module
     with open(f'{HOME}/kiwix/library_zim.xml', 'rb') as file:
         zim_dict = xmltodict.parse(file)
 
@@ -62,7 +80,7 @@ def get_zim_id(zim_file):
 # loop for removal of multiple modules until user hits 'q'
 while True:
     # Display all installed modules
-    print(f"\nCurrent free disk space: {(psutil.disk_usage('/').free)//(2**30)}GB free.")
+    print(f"\nCurrent free disk space: {get_free_space()}GB free.")
     print('Searching for all installed modules (this will take a few moments)...')
     print('Installed modules:')
     counter = 0
@@ -102,12 +120,17 @@ while True:
         if id == None:
             sys.exit('Error retrieving id from kiwix XML library')
         do(f'{HOME}/kiwix/kiwix-manage {HOME}/kiwix/library_zim.xml remove {id}')
-        do(f'rm -rf /var/www/modules/{module_dir}')
-        do('pkill -SIGHUP kiwix-serve')   # restart kiwix server
+        storage.remove_module(module_dir)
+        # reload kiwix library without dropping requests (on failure the running server is left unchanged)
+        do(f'/usr/local/bin/archie-kiwix-reload --kiwix {HOME}/kiwix') or print('Unable to reload the kiwix library; kiwix continues to serve the previous library')
     # Otherwise, if this is not a Kiwix module, simply delete the corresponding folder
     else:
         print(f'Removing /var/www/modules/{module_dir}...')
-        do(f'rm -rf /var/www/modules/{module_dir}') or sys.exit('Error moving content')
+        storage.remove_module(module_dir) or sys.exit('Error moving content')
+
+    # remove the module from the manifest and the landing page
+    storage.update_manifest(module_dir)
+    clear_page_cache()
 
     reply = input('Done.\nDo you want to remove another module? (y/n) ')
     if reply not in 'yY':
@@ -116,5 +139,5 @@ while True:
 # Once content is installed and configured, return root partition to read-only mode
 do('mount -o remount,ro /')
 
-print(f"\nDONE! ({(psutil.disk_usage('/').free)//(2**30)}GB free).")
+print(f"\nDONE! ({get_free_space()}GB free).")
 print('** Each content module is subject to its own license terms and conditions.')
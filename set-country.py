@@ -11,10 +11,14 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
-import pycountry
 import sys
 import fileinput
+import json
 import subprocess
+from countries import COUNTRIES, search
+
+# Wi-Fi access point settings chosen by setup.py for the original country
+WIFI_SETTINGS_FILE = '/etc/archie-pi/wifi.json'
 
 # Helper functions
 def do(cmd):
@@ -35,16 +39,37 @@ def replace_line(orig_line, new_line, infile):
             print(line, end='')
     return found
 
-print('For reference, here is a list of countries and their corresponding country codes:')
-codes = []
-for country in list(pycountry.countries):
-    print(f'{country.name}={country.alpha_2}',end=' ')
-    codes.append(country.alpha_2)
+def complete(text, state):
+    ''' readline completer: complete a partially typed country name or code
+    '''
+    matches = [f'{code} ({name})' for code, name in search(text)] if text else []
+    return matches[state] if state < len(matches) else None
+
+# Search-as-you-type: pressing TAB lists the countries matching what has been typed so far
+try:
+    import readline
+    readline.set_completer(complete)
+    readline.set_completer_delims('')
+    readline.parse_and_bind('tab: complete')
+except ImportError:
+    pass
 
-code = input('\n\nPlease enter the country code for the ARCHIE Pi Wi-Fi setup: ')
-if code not in codes:
-    print('Sorry, uncrecognized country code...')
-    sys.exit(1)
+print('Type a country code, or part of a country name to search (press TAB to list matches).')
+while True:
+    text = input('\nPlease enter the country code for the ARCHIE Pi Wi-Fi setup: ')
+    code = text.split(' ')[0].strip().upper()
+    if code in COUNTRIES:
+        break
+    # Otherwise treat the input as a search and show the matching countries
+    matches = search(text)
+    if len(matches) == 1:
+        code = matches[0][0]
+        break
+    if not matches:
+        print('Sorry, uncrecognized country code...')
+        sys.exit(1)
+    print('Matching countries: ' + ', '.join(f'{name}={code}' for code, name in matches))
+print(f'Using country code {code} ({COUNTRIES[code]}).')
 
 # Temporarily mount root partion in read-write mode for adding content
 do('mount -o remount,rw /')
@@ -53,6 +78,21 @@ do('mount -o remount,rw /')
 replace_line('country=', f'country={code}', '/etc/wpa_supplicant/wpa_supplicant.conf') or sys.exit('Error changing country code')
 replace_line('REGDOMAIN=', f'REGDOMAIN={code}', '/etc/default/crda') or sys.exit('Error changing regulatory domain setting')
 
+# The band and channel were chosen for the previous country and may not be permitted in the new one,
+# so switch to a 2.4GHz channel that is permitted everywhere
+try:
+    with open(WIFI_SETTINGS_FILE, 'r') as f:
+        wifi = json.load(f)
+except FileNotFoundError:
+    wifi = None
+if wifi is not None and wifi.get('country', '').upper() != code:
+    print(f"Switching the access point from band {wifi['band']} channel {wifi['channel']} to band bg channel 6...")
+    do('nmcli connection modify ap-wlan0 802-11-wireless.band bg 802-11-wireless.channel 6') or sys.exit('Error changing Wi-Fi channel')
+    wifi.update({ 'country':code, 'band':'bg', 'channel':6 })
+    with open(WIFI_SETTINGS_FILE, 'w') as f:
+        json.dump(wifi, f, indent=2)
+    print('** To use the fastest band and channel permitted in the new country, run setup.py again with --country.')
+
 # Once country is configured, return root partion to read-only mode
 do('mount -o remount,ro /')
 
@@ -11,15 +11,20 @@
 # GNU General Public License for more details.
 
 import argparse
+import json
 import os
 import shutil
 import sys
 import subprocess
 import fileinput
+import storage
 
 # Global Varaible declaration
 args: argparse.Namespace = argparse.Namespace()
 
+# Wi-Fi access point settings chosen during setup
+WIFI_SETTINGS_FILE = '/etc/archie-pi/wifi.json'
+
 # Helper functions
 
 def do(cmd, silent=False):
@@ -113,6 +118,68 @@ def get_php_version():
     except subprocess.CalledProcessError:
         return None
 
+def get_radio_capabilities(interface='wlan0'):
+    ''' Use "iw" to determine which channels the radio may use for an access point
+        under the current regulatory domain, and whether it supports 802.11n/ac.
+        Channels that are disabled, passive-only (no IR) or require radar detection are excluded.
+    '''
+    caps = { 'bg':[], 'a':[], '802.11n':False, '802.11ac':False }
+    result = subprocess.run(['iw', 'phy', get_phy(interface), 'info'], capture_output=True, text=True)
+    for line in result.stdout.split('\n'):
+        line = line.strip()
+        if line.startswith('HT20') or line.startswith('HT TX/RX MCS'):
+            caps['802.11n'] = True
+        elif line.startswith('VHT Capabilities'):
+            caps['802.11ac'] = True
+        elif line.startswith('* ') and ' MHz [' in line:
+            freq = float(line.split()[1])
+            band = 'bg' if freq < 3000 else 'a' if freq < 5900 else None
+            if band is None or 'disabled' in line or 'no IR' in line or 'radar detection' in line:
+                continue
+            caps[band].append(int(line.split('[')[1].split(']')[0]))
+    return caps
+
+def get_phy(interface):
+    ''' Return the name of the wireless device (phy) of a network interface
+    '''
+    try:
+        with open(f'/sys/class/net/{interface}/phy80211/name', 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return 'phy0'
+
+def survey_channels():
+    ''' Scan for nearby access points and return a list of (channel, signal strength) pairs
+    '''
+    result = subprocess.run(['nmcli', '-t', '-f', 'CHAN,SIGNAL', 'device', 'wifi', 'list', 'ifname', 'wlan0', '--rescan', 'yes'],
+                            capture_output=True, text=True)
+    networks = []
+    for line in result.stdout.split('\n'):
+        fields = line.split(':')
+        if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+            networks.append((int(fields[0]), int(fields[1])))
+    return networks
+
+def choose_channel(band, channels, networks):
+    ''' Return the least congested of the given channels. In the 2.4GHz band neighbouring
+        channels overlap, so nearby networks count in proportion to their overlap and
+        the non-overlapping channels 1, 6 and 11 are preferred.
+    '''
+    if band == 'bg':
+        channels = [channel for channel in channels if channel in [1, 6, 11]] or channels
+    def congestion(channel):
+        if band == 'bg':
+            return sum(signal * (5 - abs(channel - chan)) / 5 for chan, signal in networks if abs(channel - chan) < 5)
+        return sum(signal for chan, signal in networks if chan == channel)
+    return min(channels, key=congestion)
+
+def get_php_workers():
+    ''' Return the number of php-fpm workers to run based on the amount of RAM
+        (about one worker per 128MB, between 2 and 16 workers)
+    '''
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    return max(2, min(16, memory // (128 * 2**20)))
+
 #########################################################
 # Read command line parameters and set home folder
 #########################################################
@@ -125,6 +192,12 @@ def setup_init():
                         type=str, required=True)
     parser.add_argument("--ssid", dest="ssid", help="Wi-Fi acces point station id",
                         type=str, required=False, default='ARCHIE-Pi')
+    parser.add_argument("--band", dest="band", help="Wi-Fi band: bg (2.4GHz), a (5GHz) or auto (5GHz when supported and permitted)",
+                        type=str, required=False, default='auto', choices=['auto', 'bg', 'a'])
+    parser.add_argument("--channel", dest="channel", help="Wi-Fi channel, or 'survey' to pick the least congested channel",
+                        type=str, required=False, default='survey')
+    parser.add_argument("--log-dir", dest="log_dir", help="folder on a writable partition for hourly usage summaries",
+                        type=str, required=False, default=None)
     args = parser.parse_args()
     
     # Check to ensure we are running with root privileges
@@ -144,7 +217,7 @@ def install_dependencies():
     do('apt dist-upgrade -y') or sys.exit('Error: Unable to dist-upgrade Raspberry Pi OS.')
 
     do('apt -y install lynx') or sys.exit('Error: cannot install lynx dependency')
-    do('apt -y install python3-pip python3-psutil python3-pycountry python3-xmltodict') or sys.exit('Error: cannot install Python dependencies')
+    do('apt -y install python3-pip python3-psutil python3-xmltodict') or sys.exit('Error: cannot install Python dependencies')
 
     # Set current data and time
     do('apt -y install ntpdate') or sys.exit('Error: cannot install ntpdate')
@@ -169,21 +242,58 @@ def wifi_hotspot_setup():
     print('WiFi country = ', end='', flush=True)
     do('raspi-config nonint get_wifi_country', True)
 
-    # install dnsmasq-base and network-manager
-    do('apt-get -y install dnsmasq-base network-manager')
+    # install dnsmasq-base, network-manager and iw
+    do('apt-get -y install dnsmasq-base network-manager iw')
 
-    # Use NetworkManager to setup WiFi access point
+    # Disable Bluetooth and enable wifi
+    # NOTE: wifi should only be enabled when country code is set properly (which it should be here)
+    do('rfkill block bluetooth') or sys.exit('Error: bluetooth disable failed')
+    do('rfkill unblock wifi') or sys.exit('Error: wifi enable failed')
+
+    # Use the 5GHz band if the radio supports it and the country permits an access point on it
     do('nmcli connection delete ap-wlan0')   # delete if already present
+    caps = get_radio_capabilities()
+    print(f"Radio channels permitted for an access point: 2.4GHz {caps['bg']}, 5GHz {caps['a']}")
+    band = args.band
+    if band == 'auto' and args.channel.isdigit():
+        # an explicit channel selects its band (2.4GHz channels are numbered 1 to 14)
+        band = 'bg' if int(args.channel) <= 14 else 'a'
+    elif band == 'auto':
+        band = 'a' if caps['a'] else 'bg'
+    if not caps[band]:
+        print(f'Band {band} is not available on this radio in country {args.country}; using band bg')
+        band = 'bg'
+    channels = caps[band]
+    fallback = not channels
+    if fallback:
+        # the radio reported no usable channels; fall back to the channel used by earlier versions of the ARCHIE Pi
+        channels = [7]
+
+    # Survey nearby access points before the access point is brought up and pick the quietest channel
+    networks = []
+    if args.channel == 'survey':
+        print('Surveying Wi-Fi channels...')
+        networks = survey_channels()
+        channel = choose_channel(band, channels, networks)
+        print(f'Found {len(networks)} nearby access points; selected channel {channel}')
+    elif args.channel.isdigit() and int(args.channel) in channels:
+        channel = int(args.channel)
+    else:
+        sys.exit(f'Error: channel {args.channel} is not permitted in band {band} (permitted: {channels})')
+
+    # Use NetworkManager to setup WiFi access point
     do('nmcli connection add type wifi ifname wlan0 con-name ap-wlan0 wifi.mode ap autoconnect true wifi.ssid ARCHIE-Pi')
     do('nmcli connection modify ap-wlan0 ipv4.address 10.10.10.10/24')
     do('nmcli connection modify ap-wlan0 ipv6.method disabled')
-    do('nmcli connection modify ap-wlan0 802-11-wireless.mode ap 802-11-wireless.band bg ipv4.method shared')
-    do('nmcli connection modify ap-wlan0 802-11-wireless.channel 7')
+    do(f'nmcli connection modify ap-wlan0 802-11-wireless.mode ap 802-11-wireless.band {band} ipv4.method shared')
+    do(f'nmcli connection modify ap-wlan0 802-11-wireless.channel {channel}')
 
-    # Disable Bluetooth and enable wifi
-    # NOTE: wifi should only be enabled when country code is set properly (which it should be here)
-    do('rfkill block bluetooth') or sys.exit('Error: bluetooth disable failed')
-    do('rfkill unblock wifi') or sys.exit('Error: wifi enable failed')
+    # Record the settings so they can be reviewed (and checked when the country changes)
+    os.makedirs('/etc/archie-pi', exist_ok=True)
+    with open(WIFI_SETTINGS_FILE, 'w') as f:
+        json.dump({ 'country':args.country.upper(), 'band':band, 'channel':channel, 'capabilities':caps,
+                    'fallback_channel':fallback,
+                    'survey':[{ 'channel':chan, 'signal':signal } for chan, signal in networks] }, f, indent=2)
 
     # bring up the new access point
     do('nmcli connection up ap-wlan0')
@@ -203,11 +313,24 @@ def web_server_setup():
     do('apt install php-fpm php-cli -y') or sys.exit('Error: unable to install php')
     do('apt install php-sqlite3 -y') or sys.exit('Error: unable to install sqlite3')
 
+    # Run a fixed pool of php-fpm workers sized to the available RAM rather than
+    # starting workers on demand when a burst of visitors arrives
+    PHP_POOL_FILE = f'/etc/php/{get_php_version()}/fpm/pool.d/www.conf'
+    workers = get_php_workers()
+    print(f'Configuring php-fpm with {workers} workers...')
+    replace_in_file('pm = dynamic', 'pm = static', PHP_POOL_FILE) or sys.exit('Error: php-fpm pool update failed')
+    replace_in_file('pm.max_children = 5', f'pm.max_children = {workers}', PHP_POOL_FILE) or sys.exit('Error: php-fpm pool update failed')
+    replace_in_file(';pm.max_requests = 500', 'pm.max_requests = 500', PHP_POOL_FILE)
+    do(f'service php{get_php_version()}-fpm restart') or sys.exit('Error: unable to restart php-fpm')
+
     # Remove default nginx config, copy new config file, and update version in php-fpm settings
     NGINX_CONF_FILE = '/etc/nginx/conf.d/archie-pi.conf'
     do('rm /etc/nginx/sites-enabled/default')
     do(f'cp archie-pi.conf {NGINX_CONF_FILE}') or sys.exit('Error: copy new conf file')
     replace_in_file("PHP_VERSION", get_php_version(), NGINX_CONF_FILE) or sys.exit('Error: nginx php version update failed')
+
+    # nginx serves kiwix on port 81 and forwards to kiwix-serve on an internal port
+    do('cp kiwix-upstream.conf /etc/nginx/kiwix-upstream.conf') or sys.exit('Error: copy kiwix upstream file')
     
     # Install ARCHIE Pi web front page:
     print('Installing ARCHIE Pi web front end...')
@@ -237,7 +360,24 @@ def kiwix_server_setup():
     do(f'tar xzf {HOME}/kiwix-tools.tgz -C {HOME}/kiwix --strip-components=1')
     do(f'rm {HOME}/kiwix-tools.tgz')
     do(f'touch {HOME}/kiwix/library_zim.xml')
-    replace_in_file('fi',f'fi\n\n{HOME}/kiwix/kiwix-serve --library --port 81 --blockexternal --nolibrarybutton --daemon {HOME}/kiwix/library_zim.xml', '/etc/rc.local') or sys.exit('rc.local line not updated')
+
+    # kiwix-serve is started (and later reloaded without downtime) by the reload script
+    do('cp kiwix-reload.py /usr/local/bin/archie-kiwix-reload') or sys.exit('Error: copy kiwix reload script')
+    do('chmod 755 /usr/local/bin/archie-kiwix-reload') or sys.exit('Error: kiwix reload script chmod failed')
+    replace_in_file('fi',f'fi\n\n/usr/local/bin/archie-kiwix-reload --boot --kiwix {HOME}/kiwix', '/etc/rc.local') or sys.exit('rc.local line not updated')
+
+###############################
+# Setup status page collector
+###############################
+def status_setup():
+    ''' Setup the background collector for the status page (www/status.php)
+    '''
+    print('Setting up status page collector...')
+    do('cp status-collector.py /usr/local/bin/archie-status') or sys.exit('Error: copy status collector')
+    do('chmod 755 /usr/local/bin/archie-status') or sys.exit('Error: status collector chmod failed')
+    replace_in_file('fi','fi\n\n/usr/local/bin/archie-status &', '/etc/rc.local') or sys.exit('rc.local line not updated')
+    # list modules that are already installed (such as custom content) in the module manifest
+    storage.update_manifest()
 
 ##############################
 ### Harden the install
@@ -281,6 +421,18 @@ def harden_setup():
 
     # nginx requires the log folder be present; create folder in the tmpfs at each startup
     append_file('/var/spool/cron/crontabs/root','@reboot mkdir /var/log/nginx') or sys.exit('crontab append error')
+
+    # Keep nginx logs within a fixed RAM budget: rotate by size every few minutes and
+    # summarize each log before it is rotated away
+    print('Setting up log rotation and summaries...')
+    do('cp log-summary.py /usr/local/bin/archie-log-summary') or sys.exit('Error: copy log summary script')
+    do('chmod 755 /usr/local/bin/archie-log-summary') or sys.exit('Error: log summary script chmod failed')
+    do('cp nginx-logrotate.conf /etc/logrotate.d/nginx') or sys.exit('Error: copy nginx logrotate config')
+    append_file('/var/spool/cron/crontabs/root','*/2 * * * * /usr/sbin/logrotate /etc/logrotate.d/nginx') or sys.exit('crontab append error')
+
+    # Optionally save the usage summary to a writable partition once an hour
+    if args.log_dir is not None:
+        append_file('/var/spool/cron/crontabs/root',f'@hourly /usr/local/bin/archie-log-summary --flush {args.log_dir}') or sys.exit('crontab append error')
     do('chmod 600 /var/spool/cron/crontabs/root') or sys.exit('Error: crontab chmod failed')
 
     # Move hwclock to a tmpfs folder
@@ -307,8 +459,9 @@ if __name__ == "__main__" :
     wifi_hotspot_setup()        # Step 2
     web_server_setup()          # Step 3
     kiwix_server_setup()        # Step 4
-    harden_setup()              # Step 5
-    clean_up()                  # Step 6
+    status_setup()              # Step 5
+    harden_setup()              # Step 6
+    clean_up()                  # Step 7
     
     print('\nThe ARCHIE Pi access point has installed successfully!')
     print(f'Connect a computer to the wifi access point named {args.ssid} and point a browser to: http://10.10.10.10/.')
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# Background collector for the status page of the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education).
+#
+# System statistics are sampled periodically and saved to a small JSON file in RAM,
+# which status.php returns as is. Polling the status page therefore adds no load.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import time
+import urllib.request
+
+# Status file read by status.php (/run is a tmpfs)
+STATUS_FILE = '/run/archie-pi/status.json'
+
+# Folder through which all modules are served
+MODULES_DIR = '/var/www/modules'
+
+# Installed modules (maintained by install-modules.py and remove-modules.py)
+MANIFEST_FILE = '/etc/archie-pi/modules.json'
+
+# Additional module storage (see manage-storage.py)
+STORAGE_FILE = '/etc/archie-pi/storage.json'
+
+# nginx upstream file that selects the active kiwix-serve instance (see kiwix-reload.py)
+UPSTREAM_FILE = '/etc/nginx/kiwix-upstream.conf'
+
+# Meaning of the bits reported by "vcgencmd get_throttled"
+THROTTLE_FLAGS = { 0:'under-voltage', 1:'frequency capped', 2:'throttled', 3:'soft temperature limit' }
+
+# Helper functions
+def read_json(file, default):
+    ''' Return the content of a JSON file (or a default if it does not exist)
+    '''
+    try:
+        with open(file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+def get_modules():
+    ''' Return the installed modules from the manifest. Folders added since the manifest
+        was last updated (such as custom content) are listed by folder name.
+    '''
+    modules = read_json(MANIFEST_FILE, {'modules':{}})['modules']
+    try:
+        with os.scandir(MODULES_DIR) as folders:
+            installed = { folder.name for folder in folders if folder.is_dir() and not folder.name.startswith('.') }
+    except OSError:
+        return modules
+    for name in installed - modules.keys():
+        try:
+            kiwix = any(file.endswith('.zim') for file in os.listdir(os.path.join(MODULES_DIR, name)))
+        except OSError:
+            kiwix = False
+        modules[name] = { 'name':name, 'kiwix':kiwix }
+    return { name:module for name, module in modules.items() if name in installed }
+
+def get_kiwix_status():
+    ''' Check whether the active kiwix-serve instance answers
+    '''
+    try:
+        with open(UPSTREAM_FILE, 'r') as f:
+            port = int(re.search(r'server\s+127\.0\.0\.1:(\d+)', f.read()).group(1))
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=2) as response:
+            return response.status == 200
+    except (OSError, AttributeError):
+        return False
+
+def get_disks():
+    ''' Return the free and total space of the root partition and any module storage
+    '''
+    disks = {}
+    for path in ['/'] + [root['path'] for root in read_json(STORAGE_FILE, {'roots':[]})['roots']]:
+        try:
+            stats = os.statvfs(path)
+        except OSError:
+            disks[path] = None   # storage not mounted
+            continue
+        disks[path] = { 'free_mb':stats.f_bavail * stats.f_frsize // 2**20, 'total_mb':stats.f_blocks * stats.f_frsize // 2**20 }
+    return disks
+
+def get_memory():
+    ''' Return the total and available memory in MB
+    '''
+    memory = {}
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            key, value = line.split(':')
+            if key in ['MemTotal', 'MemAvailable']:
+                memory[key] = int(value.split()[0]) // 1024
+    return { 'total_mb':memory.get('MemTotal'), 'available_mb':memory.get('MemAvailable') }
+
+def get_temperature():
+    ''' Return the CPU temperature in degrees Celsius
+    '''
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+def get_throttling():
+    ''' Return the current and past throttling conditions reported by the firmware
+    '''
+    try:
+        result = subprocess.run(['vcgencmd', 'get_throttled'], capture_output=True, text=True)
+        value = int(result.stdout.strip().split('=')[1], 16)
+    except (OSError, IndexError, ValueError):
+        return None
+    return { 'now':[name for bit, name in THROTTLE_FLAGS.items() if value & (1 << bit)],
+             'since_boot':[name for bit, name in THROTTLE_FLAGS.items() if value & (1 << (bit + 16))] }
+
+def get_clients():
+    ''' Return the number of devices connected to the Wi-Fi access point
+    '''
+    try:
+        result = subprocess.run(['iw', 'dev', 'wlan0', 'station', 'dump'], capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.count('Station ')
+
+def collect(interval):
+    ''' Sample the system status
+    '''
+    with open('/proc/uptime', 'r') as f:
+        uptime = int(float(f.read().split()[0]))
+    return { 'time':int(time.time()),
+             'interval':interval,
+             'uptime_s':uptime,
+             'kiwix_up':get_kiwix_status(),
+             'modules':get_modules(),
+             'disks':get_disks(),
+             'memory':get_memory(),
+             'load':os.getloadavg(),
+             'cpu_temperature_c':get_temperature(),
+             'throttling':get_throttling(),
+             'wifi_clients':get_clients() }
+
+def save(status):
+    ''' Save the status atomically so status.php never reads a partial file
+    '''
+    os.makedirs(os.path.dirname(STATUS_FILE), mode=0o755, exist_ok=True)
+    with open(STATUS_FILE + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.chmod(STATUS_FILE + '.tmp', 0o644)
+    os.replace(STATUS_FILE + '.tmp', STATUS_FILE)
+
+################
+##### MAIN #####
+################
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description='Collect ARCHIE Pi status for the status page')
+    parser.add_argument("--interval", dest="interval", help="seconds between samples",
+                        type=int, required=False, default=30)
+    parser.add_argument("--once", dest="once", help="collect a single sample and exit",
+                        action='store_true')
+    args = parser.parse_args()
+
+    while True:
+        save(collect(args.interval))
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,289 @@
+# Storage layout of content modules for the ARCHIE Pi
+# (Another Remote Community Hotspot for Instruction and Education).
+#
+# Modules are always reachable as /var/www/modules/<module>. By default they are stored
+# there on the SD card, but additional storage roots (such as a USB SSD) can be added with
+# manage-storage.py. A module stored on another root lives in <root>/archie-modules/<module>
+# and /var/www/modules/<module> is a symbolic link to it. Frequently used and small modules
+# are placed on the fastest storage that has room.
+#
+# (C) 2024 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import grp
+import json
+import os
+import pwd
+import re
+import shutil
+import subprocess
+import sys
+
+# Folder through which all modules are served
+MODULES_DIR = '/var/www/modules'
+
+# Additional storage roots configured with manage-storage.py
+STORAGE_FILE = '/etc/archie-pi/storage.json'
+
+# Manifest of installed modules (read by the status collector instead of scanning folders)
+MANIFEST_FILE = '/etc/archie-pi/modules.json'
+
+# Folder (on the same partition as MODULES_DIR) used while a module is being moved
+MOVING_DIR = '/var/www/.modules-moving'
+
+# Module usage counts collected from the web server logs (see log-summary.py)
+USAGE_FILE = '/var/log/archie-pi/summary.json'
+
+# Free space kept in reserve on each storage root
+RESERVE = 2**30
+
+# The SD card is always available as the last (slowest) storage root
+SD_ROOT = { 'path':MODULES_DIR, 'tier':'sd' }
+
+# Order in which storage tiers are filled
+TIERS = ['fast', 'slow', 'sd']
+
+def check_filesystem(folder):
+    ''' Return None if a folder can hold modules, otherwise the reason it cannot.
+        Modules need POSIX file ownership (for the web server) and symbolic links,
+        which filesystems such as vfat, exfat and ntfs do not support.
+    '''
+    test = os.path.join(folder, '.archie-test')
+    try:
+        with open(test, 'w'):
+            pass
+        uid, gid = pwd.getpwnam('www-data').pw_uid, grp.getgrnam('www-data').gr_gid
+        os.chown(test, uid, gid)
+        if (os.stat(test).st_uid, os.stat(test).st_gid) != (uid, gid):
+            return 'file ownership is not supported'
+        os.symlink(test, test + '.link')
+        os.unlink(test + '.link')
+    except KeyError:
+        return 'the www-data user does not exist'
+    except OSError as e:
+        return str(e)
+    finally:
+        if os.path.lexists(test):
+            os.unlink(test)
+    return None
+
+def load_roots():
+    ''' Return all storage roots ordered from fastest to slowest
+    '''
+    try:
+        with open(STORAGE_FILE, 'r') as f:
+            roots = json.load(f)['roots']
+    except FileNotFoundError:
+        roots = []
+    return sorted(roots, key=lambda root: TIERS.index(root['tier'])) + [SD_ROOT]
+
+def save_roots(roots):
+    ''' Save the additional storage roots
+    '''
+    os.makedirs(os.path.dirname(STORAGE_FILE), exist_ok=True)
+    with open(STORAGE_FILE, 'w') as f:
+        json.dump({ 'roots':[root for root in roots if root is not SD_ROOT] }, f, indent=2)
+
+def get_root_dir(root):
+    ''' Return the folder in which a storage root keeps its modules
+    '''
+    return MODULES_DIR if root is SD_ROOT else os.path.join(root['path'], 'archie-modules')
+
+def get_free(root):
+    ''' Return the free space of a storage root in bytes (less the reserve)
+    '''
+    stats = os.statvfs(root['path'])
+    return stats.f_bavail * stats.f_frsize - RESERVE
+
+def get_module_root(name, roots):
+    ''' Return the storage root that holds a module
+    '''
+    path = os.path.realpath(os.path.join(MODULES_DIR, name))
+    for root in roots:
+        if root is not SD_ROOT and path.startswith(get_root_dir(root) + '/'):
+            return root
+    return SD_ROOT
+
+def get_module_size(name):
+    ''' Return the size of a module in bytes
+    '''
+    path = os.path.realpath(os.path.join(MODULES_DIR, name))
+    return int(subprocess.check_output(['du', '-sb', path]).split()[0])
+
+def get_hits(usage_file=None):
+    ''' Return the number of requests for each module from the log summary kept in RAM
+        and, optionally, from the usage history saved by log-summary.py --flush
+    '''
+    hits = {}
+    try:
+        with open(USAGE_FILE, 'r') as f:
+            hits.update(json.load(f)['modules'])
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    if usage_file is not None:
+        with open(usage_file, 'r') as f:
+            for line in f:
+                for module, count in json.loads(line).get('modules', {}).items():
+                    hits[module] = hits.get(module, 0) + count
+    return hits
+
+def choose_root(size, roots):
+    ''' Choose the storage root for a new module of (approximately) the given size.
+        New modules have not been used yet, so small modules go to the fastest storage
+        with room, while a module that would take more than a quarter of the free space
+        on fast storage is placed on slower storage.
+    '''
+    for root in roots:
+        free = get_free(root)
+        if size <= free and (root['tier'] != 'fast' or size <= free // 4):
+            return root
+    return SD_ROOT
+
+def place_module(name, size):
+    ''' Prepare the folder for a new module on the chosen storage root and return its path
+    '''
+    root = choose_root(size, load_roots())
+    path = os.path.join(MODULES_DIR, name)
+    if root is SD_ROOT or os.path.lexists(path):
+        return path
+    print(f"Placing {name} on {root['path']} ({root['tier']} storage)...")
+    os.makedirs(os.path.join(get_root_dir(root), name), exist_ok=True)
+    os.symlink(os.path.join(get_root_dir(root), name), path)
+    return path
+
+def describe_module(name):
+    ''' Return the manifest entry of a module that was not installed by install-modules.py
+        (such as custom content or a module installed before the manifest was kept)
+    '''
+    path = os.path.join(MODULES_DIR, name)
+    info = { 'name':name, 'kiwix':False, 'installed':int(os.stat(path).st_mtime) }
+    try:
+        # the module name is the heading of the module on the main page
+        with open(os.path.join(path, 'index.htmlf'), 'r', errors='replace') as f:
+            match = re.search(r'<h2>\s*<a[^>]*>([^<]+)</a>', f.read())
+        if match is not None:
+            info['name'] = match.group(1).strip()
+    except OSError:
+        pass
+    # kiwix modules hold a ZIM file
+    info['kiwix'] = any(file.endswith('.zim') for file in os.listdir(path))
+    return info
+
+def update_manifest(name=None, info=None):
+    ''' Record an installed module in the manifest (or remove it when info is None).
+        Modules in MODULES_DIR that are missing from the manifest are added, and modules
+        that are no longer installed are dropped, so the manifest can also be built from scratch.
+    '''
+    try:
+        with open(MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = { 'modules':{} }
+    if name is not None:
+        if info is None:
+            manifest['modules'].pop(name, None)
+        else:
+            manifest['modules'][name] = info
+    with os.scandir(MODULES_DIR) as modules:
+        installed = { module.name for module in modules if module.is_dir() and not module.name.startswith('.') }
+    for module in installed - manifest['modules'].keys():
+        manifest['modules'][module] = describe_module(module)
+    for module in manifest['modules'].keys() - installed:
+        manifest['modules'].pop(module)
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    with open(MANIFEST_FILE + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(MANIFEST_FILE + '.tmp', MANIFEST_FILE)
+
+def remove_module(name, folder=MODULES_DIR):
+    ''' Delete a module from whichever storage root holds it
+    '''
+    path = os.path.join(folder, name)
+    try:
+        if os.path.islink(path):
+            shutil.rmtree(os.path.realpath(path), ignore_errors=True)
+            os.unlink(path)
+        else:
+            shutil.rmtree(path)
+    except OSError as e:
+        print(f'unable to remove {path}: {e}')
+        return False
+    return True
+
+def plan(sizes, hits, roots):
+    ''' Assign each module to a storage root. Modules with the most requests per byte
+        (hot and small modules) are placed first, on the fastest storage with room.
+        Returns a dictionary of module -> storage root.
+    '''
+    # Space available on each root counts the modules it already holds
+    available = { root['path']:get_free(root) for root in roots }
+    for name, size in sizes.items():
+        available[get_module_root(name, roots)['path']] += size
+
+    placement = {}
+    for name in sorted(sizes, key=lambda name: (-hits.get(name, 0) / max(sizes[name], 1), sizes[name])):
+        # A module that fits nowhere else stays where it is
+        placement[name] = get_module_root(name, roots)
+        for root in roots:
+            if sizes[name] <= available[root['path']]:
+                placement[name] = root
+                break
+        available[placement[name]['path']] -= sizes[name]
+    return placement
+
+def move_module(name, root):
+    ''' Move a module to another storage root. The module is copied first and then
+        switched over with a rename, so it stays available while it is moved.
+    '''
+    path = os.path.join(MODULES_DIR, name)
+    source = os.path.realpath(path)
+    old = os.path.join(MOVING_DIR, name + '.old')
+    link = os.path.join(MOVING_DIR, name + '.link')
+    os.makedirs(MOVING_DIR, exist_ok=True)
+    if root is SD_ROOT:
+        destination = os.path.join(MOVING_DIR, name)
+    else:
+        destination = os.path.join(get_root_dir(root), name)
+    print(f"Moving {name} to {root['path']}...")
+    # remove anything left over from an interrupted move
+    shutil.rmtree(destination, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.makedirs(destination)
+    result = subprocess.run(['cp', '-a', source + '/.', destination], stderr=sys.stderr, stdout=sys.stdout)
+    if result.returncode != 0:
+        shutil.rmtree(destination, ignore_errors=True)
+        return False
+
+    try:
+        if root is SD_ROOT:
+            # Replace the link with the copied folder
+            os.unlink(path)
+            os.rename(destination, path)
+        else:
+            # Point a new link at the copy and swap it in
+            os.symlink(destination, link)
+            if not os.path.islink(path):
+                os.rename(path, old)
+                source = old
+            os.replace(link, path)
+    except OSError as e:
+        print(f'unable to switch {path} to the copy in {destination}: {e}')
+        # Put the module back where it was and drop the copy
+        if not os.path.lexists(path):
+            if os.path.isdir(old):
+                os.rename(old, path)
+            else:
+                os.symlink(source, path)
+        if os.path.lexists(link):
+            os.unlink(link)
+        shutil.rmtree(destination, ignore_errors=True)
+        return False
+    shutil.rmtree(source, ignore_errors=True)
+    return True
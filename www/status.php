@@ -0,0 +1,31 @@
+<?php
+// ARCHIE Pi status page: returns the system status sampled by the status collector
+// (status-collector.py) as JSON. Use status.php?ready for a readiness check, which
+// returns HTTP 503 unless the status is current and, when kiwix modules are installed,
+// the kiwix server is running.
+header('Content-Type: application/json');
+header('Cache-Control: no-store');
+
+$status = @file_get_contents('/run/archie-pi/status.json');
+if ($status === false) {
+    http_response_code(503);
+    echo json_encode(array('ready' => false, 'error' => 'status not collected yet'));
+    exit;
+}
+
+$status = json_decode($status, true);
+$status['age_s'] = time() - $status['time'];
+// The kiwix server is only needed when kiwix modules are installed
+$kiwix_needed = false;
+foreach ($status['modules'] as $module) {
+    if (!empty($module['kiwix'])) {
+        $kiwix_needed = true;
+    }
+}
+// The status is stale if the collector has missed several samples
+$status['ready'] = $status['age_s'] <= 3 * $status['interval'] && (!$kiwix_needed || $status['kiwix_up']);
+if (isset($_GET['ready']) && !$status['ready']) {
+    http_response_code(503);
+}
+echo json_encode($status);
+?>